@@ -1,4 +1,4 @@
-import os, asyncio, asyncpg
+import os, gzip, asyncio, asyncpg, datetime as dt
 
 DDL_CREATE = [
     """CREATE TABLE IF NOT EXISTS foody_restaurants (
@@ -25,17 +25,25 @@ DDL_CREATE = [
         expires_at TIMESTAMPTZ,
         archived_at TIMESTAMPTZ,
         photo_url TEXT,
-        created_at TIMESTAMPTZ DEFAULT NOW()
+        created_at TIMESTAMPTZ DEFAULT NOW(),
+        updated_at TIMESTAMPTZ DEFAULT NOW()
     )""",
-    """CREATE TABLE IF NOT EXISTS foody_reservations (
-        id TEXT PRIMARY KEY,
+]
+
+# Reservations are range-partitioned by month on created_at. The partition key has
+# to be part of the primary key, so `code` can't be UNIQUE across partitions; it is
+# indexed instead and create_reservation re-rolls a code that is already taken.
+RESERVATIONS_DDL = """CREATE TABLE IF NOT EXISTS foody_reservations (
+        id TEXT NOT NULL,
         offer_id TEXT NOT NULL REFERENCES foody_offers(id) ON DELETE CASCADE,
-        code TEXT UNIQUE NOT NULL,
+        code TEXT NOT NULL,
         status TEXT NOT NULL DEFAULT 'reserved',
-        created_at TIMESTAMPTZ DEFAULT NOW(),
-        redeemed_at TIMESTAMPTZ
-    )"""
-]
+        qty INT NOT NULL DEFAULT 1,
+        created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+        redeemed_at TIMESTAMPTZ,
+        PRIMARY KEY (id, created_at)
+    ) PARTITION BY RANGE (created_at)"""
+DDL_CREATE.append(RESERVATIONS_DDL)
 
 DDL_ALTER = [
     "ALTER TABLE IF EXISTS foody_reservations ADD COLUMN IF NOT EXISTS qty INT NOT NULL DEFAULT 1",
@@ -51,9 +59,169 @@ DDL_ALTER = [
     "ALTER TABLE IF EXISTS foody_offers ADD COLUMN IF NOT EXISTS qty_total INTEGER",
     "ALTER TABLE IF EXISTS foody_offers ADD COLUMN IF NOT EXISTS expires_at TIMESTAMPTZ",
     "ALTER TABLE IF EXISTS foody_offers ADD COLUMN IF NOT EXISTS archived_at TIMESTAMPTZ",
-    "ALTER TABLE IF EXISTS foody_offers ADD COLUMN IF NOT EXISTS photo_url TEXT"
+    "ALTER TABLE IF EXISTS foody_offers ADD COLUMN IF NOT EXISTS photo_url TEXT",
+    "ALTER TABLE IF EXISTS foody_offers ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ DEFAULT NOW()"
 ]
 
+DDL_INDEX = [
+    "CREATE INDEX IF NOT EXISTS foody_offers_rid_updated_idx ON foody_offers(restaurant_id, updated_at)",
+    "CREATE INDEX IF NOT EXISTS foody_reservations_code_idx ON foody_reservations(code)",
+    "CREATE INDEX IF NOT EXISTS foody_reservations_offer_idx ON foody_reservations(offer_id, created_at)"
+]
+
+PARTITIONS_AHEAD = int(os.getenv("PARTITIONS_AHEAD", "2"))            # upcoming months kept ready
+# Archival is opt-in: it drops data from the database, and the dump is the only copy left.
+# Both settings are required; ARCHIVE_DIR must be a persistent volume, not the container disk.
+RETENTION_MONTHS = int(os.getenv("RESERVATIONS_RETENTION_MONTHS", "0"))
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "")
+ARCHIVE_LOCK_ID = 0x466F6F6479  # pg advisory lock: one process archives at a time
+
+def _fsync(path: str):
+    fd = os.open(path, os.O_RDONLY)
+    try: os.fsync(fd)
+    finally: os.close(fd)
+
+def month_start(d: dt.date) -> dt.date:
+    return dt.date(d.year, d.month, 1)
+
+def add_months(d: dt.date, n: int) -> dt.date:
+    y, m = divmod(d.month - 1 + n, 12)
+    return dt.date(d.year + y, m + 1, 1)
+
+def partition_name(month: dt.date) -> str:
+    return f"foody_reservations_p{month:%Y%m}"
+
+RESERVATION_COLS = "id, offer_id, code, status, qty, created_at, redeemed_at"
+
+async def create_partition(conn, month: dt.date):
+    """Create the month's partition. If the default partition already holds rows for that
+    month (upkeep didn't run in time), move them into a fresh table and ATTACH it instead."""
+    name = partition_name(month)
+    if await conn.fetchval("SELECT to_regclass($1)", name):
+        return
+    bounds = f"FROM ('{month} 00:00:00+00') TO ('{add_months(month, 1)} 00:00:00+00')"
+    lo = dt.datetime.combine(month, dt.time(), tzinfo=dt.timezone.utc)
+    hi = dt.datetime.combine(add_months(month, 1), dt.time(), tzinfo=dt.timezone.utc)
+    async with conn.transaction():
+        stray = 0
+        if await conn.fetchval("SELECT to_regclass('foody_reservations_default')"):
+            stray = await conn.fetchval(
+                "SELECT COUNT(*) FROM foody_reservations_default WHERE created_at >= $1 AND created_at < $2", lo, hi)
+        if not stray:
+            await conn.execute(f"CREATE TABLE {name} PARTITION OF foody_reservations FOR VALUES {bounds}")
+            return
+        await conn.execute(f"CREATE TABLE {name} (LIKE foody_reservations INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+        await conn.execute(
+            f"""INSERT INTO {name}({RESERVATION_COLS}) SELECT {RESERVATION_COLS} FROM foody_reservations_default
+                WHERE created_at >= $1 AND created_at < $2""", lo, hi)
+        await conn.execute("DELETE FROM foody_reservations_default WHERE created_at >= $1 AND created_at < $2", lo, hi)
+        await conn.execute(f"ALTER TABLE foody_reservations ATTACH PARTITION {name} FOR VALUES {bounds}")
+    print("BOOTSTRAP: moved", stray, "rows from foody_reservations_default into", name)
+
+async def convert_reservations(conn):
+    """One-off: move a legacy unpartitioned foody_reservations into the partitioned layout."""
+    kind = await conn.fetchval("SELECT relkind FROM pg_class WHERE relname='foody_reservations' AND relkind IN ('r','p')")
+    if kind != "r":
+        return
+    async with conn.transaction():
+        await conn.execute("ALTER TABLE foody_reservations RENAME TO foody_reservations_legacy")
+        await conn.execute("ALTER INDEX IF EXISTS foody_reservations_pkey RENAME TO foody_reservations_legacy_pkey")
+        await conn.execute("ALTER INDEX IF EXISTS foody_reservations_code_key RENAME TO foody_reservations_legacy_code_key")
+        await conn.execute(RESERVATIONS_DDL)
+        first = await conn.fetchval("SELECT MIN(created_at) FROM foody_reservations_legacy")
+        month = month_start(first.date() if first else dt.datetime.utcnow().date())
+        while month <= month_start(dt.datetime.utcnow().date()):
+            await create_partition(conn, month)
+            month = add_months(month, 1)
+        await conn.execute("CREATE TABLE IF NOT EXISTS foody_reservations_default PARTITION OF foody_reservations DEFAULT")
+        await conn.execute(
+            f"""INSERT INTO foody_reservations({RESERVATION_COLS})
+                SELECT id, offer_id, code, status, qty, COALESCE(created_at, NOW()), redeemed_at FROM foody_reservations_legacy"""
+        )
+        await conn.execute("DROP TABLE foody_reservations_legacy")
+    print("BOOTSTRAP: foody_reservations converted to monthly partitions")
+
+async def archive_reservations(conn, before: dt.date):
+    """Detach partitions that end before `before`, dump them to ARCHIVE_DIR as csv.gz, drop them.
+    Partitions left detached by an interrupted run are picked up again."""
+    rows = await conn.fetch(
+        r"""SELECT relname, relispartition FROM pg_class
+            WHERE relkind='r' AND relname ~ '^foody_reservations_p[0-9]{6}$' ORDER BY relname"""
+    )
+    for r in rows:
+        name = r["relname"]
+        month = dt.date(int(name[-6:-2]), int(name[-2:]), 1)
+        if add_months(month, 1) > before:
+            continue
+        if r["relispartition"]:
+            await conn.execute(f"ALTER TABLE foody_reservations DETACH PARTITION {name}")
+        os.makedirs(ARCHIVE_DIR, exist_ok=True)
+        path = os.path.join(ARCHIVE_DIR, f"{name}.csv.gz")
+        with gzip.open(path + ".tmp", "wb") as f:
+            await conn.copy_from_table(name, output=f, format="csv", header=True)
+        _fsync(path + ".tmp")
+        os.replace(path + ".tmp", path)
+        _fsync(ARCHIVE_DIR)
+        await conn.execute(f"DROP TABLE {name}")
+        print("BOOTSTRAP: archived", name, "->", path)
+
+async def archive_offers(conn, before: dt.date):
+    """Dump and delete offers archived (deleted by the merchant) before `before` that no live
+    reservation references. Merchants already got their tombstone when archived_at was set."""
+    cond = """archived_at < $1
+              AND NOT EXISTS (SELECT 1 FROM foody_reservations r WHERE r.offer_id=foody_offers.id)"""
+    cutoff = dt.datetime.combine(before, dt.time(), tzinfo=dt.timezone.utc)
+    async with conn.transaction(isolation="repeatable_read"):
+        n = await conn.fetchval(f"SELECT COUNT(*) FROM foody_offers WHERE {cond}", cutoff)
+        if not n:
+            return
+        os.makedirs(ARCHIVE_DIR, exist_ok=True)
+        path = os.path.join(ARCHIVE_DIR, f"foody_offers_{dt.datetime.utcnow():%Y%m%d%H%M%S}.csv.gz")
+        with gzip.open(path, "wb") as f:
+            await conn.copy_from_query(f"SELECT * FROM foody_offers WHERE {cond}", cutoff,
+                                       output=f, format="csv", header=True)
+        _fsync(path)
+        _fsync(ARCHIVE_DIR)
+        await conn.execute(f"DELETE FROM foody_offers WHERE {cond}", cutoff)
+    print("BOOTSTRAP: archived", n, "offers ->", path)
+
+async def maintain_partitions(conn):
+    this_month = month_start(dt.datetime.utcnow().date())
+    months = {add_months(this_month, i) for i in range(PARTITIONS_AHEAD + 1)}
+    try:
+        # months that already spilled into the default partition (e.g. upkeep was down for a while)
+        rows = await conn.fetch(
+            """SELECT DISTINCT date_trunc('month', created_at AT TIME ZONE 'UTC')::date AS m
+               FROM foody_reservations_default""")
+        months |= {r["m"] for r in rows}
+    except asyncpg.UndefinedTableError:
+        pass
+    for month in sorted(months):
+        try:
+            await create_partition(conn, month)
+        except Exception as e:
+            print("BOOTSTRAP PARTITION WARN:", partition_name(month), "->", repr(e))
+    try:
+        await conn.execute("CREATE TABLE IF NOT EXISTS foody_reservations_default PARTITION OF foody_reservations DEFAULT")
+    except Exception as e:
+        print("BOOTSTRAP PARTITION WARN:", repr(e))
+    if RETENTION_MONTHS <= 0:
+        return
+    if not ARCHIVE_DIR:
+        print("BOOTSTRAP ARCHIVE WARN: RESERVATIONS_RETENTION_MONTHS is set but ARCHIVE_DIR is not, skip archival")
+        return
+    if not await conn.fetchval("SELECT pg_try_advisory_lock($1)", ARCHIVE_LOCK_ID):
+        return
+    try:
+        before = add_months(this_month, -RETENTION_MONTHS)
+        for step in (archive_reservations, archive_offers):
+            try:
+                await step(conn, before)
+            except Exception as e:
+                print("BOOTSTRAP ARCHIVE WARN:", step.__name__, "->", repr(e))
+    finally:
+        await conn.execute("SELECT pg_advisory_unlock($1)", ARCHIVE_LOCK_ID)
+
 async def run():
     url = os.getenv("DATABASE_URL")
     if not url:
@@ -75,17 +243,53 @@ async def run():
                 await conn.execute(sql)
             except Exception as e:
                 print("BOOTSTRAP ALTER WARN:", sql, "->", repr(e))
+        try:
+            await convert_reservations(conn)
+        except Exception as e:
+            print("BOOTSTRAP PARTITION WARN: conversion ->", repr(e))
+        await maintain_partitions(conn)
+        for sql in DDL_INDEX:
+            try:
+                await conn.execute(sql)
+            except Exception as e:
+                print("BOOTSTRAP INDEX WARN:", sql, "->", repr(e))
     finally:
         try:
             await conn.close()
         except Exception:
             pass
 
-async def ensure():
-    if os.getenv("RUN_MIGRATIONS", "0").lower() not in ("1","true","yes","on"):
-        print("BOOTSTRAP: RUN_MIGRATIONS disabled")
+def enabled() -> bool:
+    return os.getenv("RUN_MIGRATIONS", "0").lower() in ("1","true","yes","on")
+
+async def maintain():
+    """Partition upkeep (create upcoming months, archive cold ones). Runs whenever
+    foody_reservations is partitioned, independent of RUN_MIGRATIONS: without it new
+    reservations would pile up in the default partition."""
+    url = os.getenv("DATABASE_URL")
+    if not url:
         return
     try:
-        await run()
+        conn = await asyncpg.connect(url)
+    except Exception as e:
+        print("BOOTSTRAP: Cannot connect to DB:", repr(e))
+        return
+    try:
+        kind = await conn.fetchval("SELECT relkind FROM pg_class WHERE relname='foody_reservations' AND relkind IN ('r','p')")
+        if kind == "p":
+            await maintain_partitions(conn)
+    finally:
+        try:
+            await conn.close()
+        except Exception:
+            pass
+
+async def ensure():
+    try:
+        if enabled():
+            await run()
+        else:
+            print("BOOTSTRAP: RUN_MIGRATIONS disabled")
+            await maintain()
     except Exception as e:
         print("BOOTSTRAP ensure warn:", repr(e))
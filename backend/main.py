@@ -1,12 +1,17 @@
-import os, io, csv, json, secrets, datetime as dt, base64, math, uuid
+import os, io, csv, json, secrets, datetime as dt, base64, math, uuid, time, asyncio, hashlib
+from collections import OrderedDict
 from typing import Optional, Dict, Any, List
 
 import asyncpg
 from fastapi import FastAPI, Header, HTTPException, Query, Body, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi.middleware.gzip import GZipMiddleware
+from starlette.datastructures import Headers
+from fastapi.responses import StreamingResponse, JSONResponse, Response
 
 import bootstrap_sql
+import ranking
+from pricing import with_timer_discount
 
 DB_URL = os.getenv("DATABASE_URL")
 
@@ -51,6 +56,7 @@ def row_offer(r: asyncpg.Record) -> Dict[str, Any]:
         "archived_at": r["archived_at"].isoformat() if r.get("archived_at") else None,
         "photo_url": r.get("photo_url"),
         "created_at": r["created_at"].isoformat() if r.get("created_at") else None,
+        "updated_at": r["updated_at"].isoformat() if r.get("updated_at") else None,
     }
 
 async def auth(conn: asyncpg.Connection, key: str, restaurant_id: Optional[str]) -> str:
@@ -62,9 +68,22 @@ async def auth(conn: asyncpg.Connection, key: str, restaurant_id: Optional[str])
     r = await conn.fetchrow("SELECT id FROM foody_restaurants WHERE api_key=$1", key)
     return r["id"] if r else ""
 
+PARTITION_MAINT_SECONDS = int(os.getenv("PARTITION_MAINT_SECONDS", str(6*3600)))
+_maintenance_task: Optional[asyncio.Task] = None
+
+async def _partition_maintenance():
+    while True:
+        await asyncio.sleep(PARTITION_MAINT_SECONDS)
+        try:
+            await bootstrap_sql.maintain()
+        except Exception as e:
+            print("Partition maintenance warn:", repr(e))
+
 @app.on_event("startup")
 async def _startup():
+    global _maintenance_task
     await bootstrap_sql.ensure()
+    _maintenance_task = asyncio.create_task(_partition_maintenance())
     try:
         p = await pool()
         async with p.acquire() as conn:
@@ -72,6 +91,59 @@ async def _startup():
     except Exception as e:
         print("Startup seed warn:", repr(e))
 
+# ---- Compression ----
+# Registered before `guard` so it wraps the route response directly: BaseHTTPMiddleware
+# re-streams bodies, and GZip/Brotli compress any streamed body regardless of minimum_size.
+try:
+    from brotli_asgi import BrotliMiddleware
+except ImportError:
+    BrotliMiddleware = None
+
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", "1024"))
+
+def accept_encodings(header: str) -> Dict[str, float]:
+    """Accept-Encoding -> {coding: q}; `br;q=0` means "not br"."""
+    out: Dict[str, float] = {}
+    for part in header.split(","):
+        name, _, params = part.partition(";")
+        name = name.strip().lower()
+        if not name: continue
+        q = 1.0
+        for prm in params.split(";"):
+            k, _, v = prm.partition("=")
+            if k.strip() == "q":
+                try: q = float(v)
+                except ValueError: q = 0.0
+        out[name] = q
+    return out
+
+class CompressionMiddleware:
+    """Negotiates br/gzip by q-value, then hands off to BrotliMiddleware / Starlette's GZipMiddleware
+    (both stream the body and only compress above `minimum_size`)."""
+    def __init__(self, app, minimum_size: int = 1024):
+        self.app = app
+        self.gzip = GZipMiddleware(app, minimum_size=minimum_size)
+        self.br = BrotliMiddleware(app, minimum_size=minimum_size, gzip_fallback=False) if BrotliMiddleware else None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        acc = accept_encodings(Headers(scope=scope).get("accept-encoding", ""))
+        br_q = acc.get("br", 0.0) if self.br else 0.0
+        gz_q = acc.get("gzip", 0.0)
+        if br_q > 0 and br_q >= gz_q:
+            return await self.br(scope, receive, send)
+        if gz_q > 0:
+            return await self.gzip(scope, receive, send)
+        return await self.app(scope, receive, send)
+
+app.add_middleware(CompressionMiddleware, minimum_size=COMPRESS_MIN_SIZE)
+
+@app.on_event("shutdown")
+async def _shutdown():
+    if _maintenance_task:
+        _maintenance_task.cancel()
+
 @app.middleware("http")
 async def guard(request: Request, call_next):
     try:
@@ -82,6 +154,63 @@ async def guard(request: Request, call_next):
         import traceback; traceback.print_exc()
         return JSONResponse({"detail": "Internal Server Error"}, status_code=500)
 
+# ---- HTTP caching ----
+# Feed versions are bumped on every offer/reservation write so list endpoints can
+# answer 304 from memory. They are per-process (one uvicorn worker per deploy);
+# the boot token makes ETags from a previous process never match.
+# The minute bucket covers changes driven by time alone (expiry, timer discount steps).
+_BOOT = secrets.token_hex(3)
+_feed_version = 0
+_merchant_versions: Dict[str, int] = {}
+
+# Verified (restaurant_id, sha256(api_key)) pairs, so the 304 path can skip auth().
+# Small LRU with a short TTL: a revoked or rotated key stops working within AUTH_CACHE_TTL.
+AUTH_CACHE_TTL = int(os.getenv("AUTH_CACHE_TTL", "300"))
+AUTH_CACHE_MAX = 1024
+_auth_cache: "OrderedDict[tuple, float]" = OrderedDict()
+
+def _auth_cache_key(restaurant_id: str, key: str) -> tuple:
+    return (restaurant_id, hashlib.sha256(key.encode("utf-8")).hexdigest())
+
+def auth_cached(restaurant_id: str, key: str) -> bool:
+    k = _auth_cache_key(restaurant_id, key)
+    exp = _auth_cache.get(k)
+    if exp is None: return False
+    if exp < time.monotonic():
+        _auth_cache.pop(k, None)
+        return False
+    return True
+
+def remember_auth(restaurant_id: str, key: str):
+    k = _auth_cache_key(restaurant_id, key)
+    _auth_cache[k] = time.monotonic() + AUTH_CACHE_TTL
+    _auth_cache.move_to_end(k)
+    while len(_auth_cache) > AUTH_CACHE_MAX:
+        _auth_cache.popitem(last=False)
+
+def bump_feed(restaurant_id: Optional[str] = None):
+    global _feed_version
+    _feed_version += 1
+    if restaurant_id:
+        _merchant_versions[restaurant_id] = _merchant_versions.get(restaurant_id, 0) + 1
+
+def feed_etag(restaurant_id: Optional[str] = None) -> str:
+    v = _merchant_versions.get(restaurant_id, 0) if restaurant_id else _feed_version
+    return f'W/"{_BOOT}-{v}-{int(time.time() // 60)}"'
+
+def etag_matches(request: Request, etag: str) -> bool:
+    inm = request.headers.get("if-none-match", "")
+    if not inm: return False
+    tags = [t.strip() for t in inm.split(",")]
+    return "*" in tags or any(t.removeprefix("W/") == etag.removeprefix("W/") for t in tags)
+
+def cache_headers(etag: str, cache_control: str) -> Dict[str, str]:
+    # the 200 and the 304 must carry the same headers: a 304 replaces the stored response's
+    return {"ETag": etag, "Cache-Control": cache_control}
+
+def not_modified(headers: Dict[str, str]) -> Response:
+    return Response(status_code=304, headers=headers)
+
 @app.get("/health")
 async def health():
     try:
@@ -155,6 +284,7 @@ async def set_profile(body: Dict[str, Any] = Body(...), x_foody_key: str = Heade
             "UPDATE foody_restaurants SET title=COALESCE($1,title), phone=$2, city=$3, address=$4, geo=$5, lat=$6, lon=$7 WHERE id=$8",
             title, phone, city, address, geo, lat, lon, rid_in
         )
+    bump_feed(rid_in)  # city/lat/lon feed into the public offer list
     return {"ok": True}
 
 # ---- Offers CRUD ----
@@ -167,12 +297,19 @@ def parse_iso(ts: Optional[str]):
         raise HTTPException(422, "expires_at must be ISO8601")
 
 @app.get("/api/v1/merchant/offers")
-async def merchant_offers(restaurant_id: str, status: Optional[str] = None, x_foody_key: str = Header(default="")):
+async def merchant_offers(request: Request, response: Response, restaurant_id: str, status: Optional[str] = None,
+                          x_foody_key: str = Header(default="")):
+    etag = feed_etag(restaurant_id)
+    validators = cache_headers(etag, "private, no-cache")
+    if x_foody_key and auth_cached(restaurant_id, x_foody_key) and etag_matches(request, etag):
+        return not_modified(validators)
     p = await pool()
     async with p.acquire() as conn:
         rid_ok = await auth(conn, x_foody_key, restaurant_id)
         if not rid_ok:
             raise HTTPException(401, "Invalid API key or restaurant_id")
+        remember_auth(restaurant_id, x_foody_key)
+        response.headers.update(validators)
         where = ["restaurant_id=$1"]
         params: List[Any] = [restaurant_id]
         if status == "active":
@@ -181,6 +318,44 @@ async def merchant_offers(restaurant_id: str, status: Optional[str] = None, x_fo
         rows = await conn.fetch(sql, *params)
         return [row_offer(r) for r in rows]
 
+OFFER_COLS = ("id, restaurant_id, title, description, price_cents, original_price_cents, qty_left, qty_total, "
+              "expires_at, archived_at, photo_url, created_at, updated_at")
+# Overlap for the delta cursor: writes whose transaction started just before the
+# previous poll may commit after it, so re-send a small window (clients upsert by id).
+SYNC_OVERLAP = dt.timedelta(seconds=5)
+
+@app.get("/api/v1/merchant/offers/changes")
+async def merchant_offer_changes(restaurant_id: str, updated_since: Optional[str] = None,
+                                 x_foody_key: str = Header(default="")):
+    """Delta feed: offers changed since `updated_since` plus tombstones for archived ones.
+    Pass the returned `cursor` as `updated_since` on the next poll; omit it for a full sync."""
+    since = None
+    if updated_since:
+        try:  # an unencoded "+00:00" offset arrives as " 00:00"
+            since = dt.datetime.fromisoformat(updated_since.strip().replace(" ", "+").replace("Z", "+00:00"))
+        except ValueError:
+            raise HTTPException(422, "updated_since must be ISO8601")
+    p = await pool()
+    async with p.acquire() as conn:
+        rid_ok = await auth(conn, x_foody_key, restaurant_id)
+        if not rid_ok:
+            raise HTTPException(401, "Invalid API key or restaurant_id")
+        now = await conn.fetchval("SELECT NOW()")
+        if since:
+            rows = await conn.fetch(f"""SELECT {OFFER_COLS} FROM foody_offers
+                                        WHERE restaurant_id=$1 AND updated_at > $2 ORDER BY updated_at""",
+                                    restaurant_id, since)
+        else:
+            rows = await conn.fetch(f"""SELECT {OFFER_COLS} FROM foody_offers
+                                        WHERE restaurant_id=$1 AND archived_at IS NULL ORDER BY updated_at""",
+                                    restaurant_id)
+        return {
+            "offers": [row_offer(r) for r in rows if r["archived_at"] is None],
+            "deleted": [r["id"] for r in rows if r["archived_at"] is not None],
+            "cursor": (now - SYNC_OVERLAP).isoformat(),
+            "full": since is None,
+        }
+
 @app.post("/api/v1/merchant/offers")
 async def create_offer(body: Dict[str, Any] = Body(...), x_foody_key: str = Header(default="")):
     rid_in = (body.get("restaurant_id") or "").strip()
@@ -210,6 +385,7 @@ async def create_offer(body: Dict[str, Any] = Body(...), x_foody_key: str = Head
                VALUES($1,$2,$3,$4,$5,$6,$7,$8,$9,$10)""",
             oid, rid_in, title, (body.get("description") or None), price_cents, original_price_cents, qty_left, qty_total, expires_ts, photo_url
         )
+        bump_feed(rid_in)
         r = await conn.fetchrow("SELECT * FROM foody_offers WHERE id=$1", oid)
         return row_offer(r)
 
@@ -240,8 +416,10 @@ async def edit_offer(offer_id: str, body: Dict[str, Any] = Body(...), x_foody_ke
         if "expires_at" in body: setf("expires_at", parse_iso(body.get("expires_at")))
         if "photo_url" in body: setf("photo_url", (body.get("photo_url") or None))
         if not fields: return {"ok": True}
+        fields.append("updated_at=NOW()")
         vals += [offer_id]
         await conn.execute(f"UPDATE foody_offers SET {', '.join(fields)} WHERE id=${len(vals)}", *vals)
+        bump_feed(rid_ok)
         r = await conn.fetchrow("SELECT * FROM foody_offers WHERE id=$1", offer_id)
         return row_offer(r)
 
@@ -254,33 +432,12 @@ async def delete_offer(offer_id: str, restaurant_id: Optional[str] = None, x_foo
         chk = await conn.fetchrow("SELECT id, restaurant_id FROM foody_offers WHERE id=$1", offer_id)
         if not chk: raise HTTPException(404, "Offer not found")
         if restaurant_id and chk["restaurant_id"] != restaurant_id: raise HTTPException(403, "Offer belongs to another restaurant")
-        await conn.execute("UPDATE foody_offers SET archived_at=NOW() WHERE id=$1", offer_id)
+        await conn.execute("UPDATE foody_offers SET archived_at=NOW(), updated_at=NOW() WHERE id=$1", offer_id)
+        bump_feed(chk["restaurant_id"])
         return {"ok": True, "deleted": offer_id}
 
 # ---- Offers public with sorting and discount ----
 
-def with_timer_discount(r: Dict[str, Any]) -> Dict[str, Any]:
-    out = dict(r)
-    now = dt.datetime.utcnow().replace(tzinfo=dt.timezone.utc)
-    expires_at = None
-    if r["expires_at"]:
-        try: expires_at = dt.datetime.fromisoformat(r["expires_at"].replace("Z","+00:00"))
-        except Exception: expires_at = None
-    discount_percent = 0; step = None
-    if expires_at:
-        delta = (expires_at - now).total_seconds() / 60.0
-        if delta <= 30: discount_percent=70; step="-70%"
-        elif delta <= 60: discount_percent=50; step="-50%"
-        elif delta <= 120: discount_percent=30; step="-30%"
-    original = r.get("original_price_cents") or r.get("price_cents")
-    current = r.get("price_cents")
-    if (original and original>0) and discount_percent>0:
-        current = int(round(original * (1 - discount_percent/100)))
-    out["timer_discount_percent"] = discount_percent
-    out["timer_step"] = step
-    out["price_cents_effective"] = current
-    return out
-
 def haversine_km(lat1, lon1, lat2, lon2):
     R=6371.0
     from math import radians, sin, cos, sqrt, asin
@@ -290,33 +447,70 @@ def haversine_km(lat1, lon1, lat2, lon2):
     c = 2*asin(sqrt(a))
     return R*c
 
+RANK_CANDIDATES = int(os.getenv("RANK_CANDIDATES", "5000"))
+RANK_RADIUS_KM = float(os.getenv("RANK_RADIUS_KM", "50"))   # coarse bbox around the buyer for relevance
+
+def enrich_offer(raw: asyncpg.Record, lat: Optional[float], lon: Optional[float]) -> Dict[str, Any]:
+    r = with_timer_discount(row_offer(raw))
+    d = None
+    if lat is not None and lon is not None and raw["rlat"] and raw["rlon"]:
+        d = haversine_km(lat, lon, raw["rlat"], raw["rlon"])
+    r["distance_km"] = d
+    r["city"] = raw["rcity"]
+    return r
+
 @app.get("/api/v1/offers")
-async def public_offers(limit: int = Query(200, ge=1, le=500), sort: str = "expiry",
+async def public_offers(request: Request, response: Response, limit: int = Query(200, ge=1, le=500), sort: str = "expiry",
                         lat: Optional[float] = None, lon: Optional[float] = None, city: Optional[str] = None):
+    etag = feed_etag()
+    validators = cache_headers(etag, "no-cache")
+    if etag_matches(request, etag):
+        return not_modified(validators)
+    response.headers.update(validators)
+    where = ["(o.archived_at IS NULL)", "(o.expires_at IS NULL OR o.expires_at > NOW())", "(o.qty_left IS NULL OR o.qty_left > 0)"]
+    params: List[Any] = []
+    if city:
+        params.append(city); where.append(f"LOWER(r.city)=LOWER(${len(params)})")
     p = await pool()
     async with p.acquire() as conn:
+        if sort=="relevance":
+            # score a wide pool of narrow rows, then load and enrich only the top `limit`
+            if lat is not None and lon is not None:
+                dlat = RANK_RADIUS_KM / 111.0
+                dlon = RANK_RADIUS_KM / (111.0 * max(math.cos(math.radians(lat)), 0.01))
+                params += [lat-dlat, lat+dlat, lon-dlon, lon+dlon]
+                n = len(params)
+                where.append(f"(r.lat IS NULL OR r.lon IS NULL OR (r.lat BETWEEN ${n-3} AND ${n-2} AND r.lon BETWEEN ${n-1} AND ${n}))")
+            params.append(max(limit, RANK_CANDIDATES))
+            cand = await conn.fetch(
+                f"""SELECT {ranking.CANDIDATE_COLS} FROM foody_offers o
+                    JOIN foody_restaurants r ON r.id=o.restaurant_id
+                    WHERE {' AND '.join(where)}
+                    ORDER BY o.expires_at NULLS LAST, o.id
+                    LIMIT ${len(params)}""", *params
+            )
+            top = ranking.rank(cand, limit, lat, lon)
+            rows = await conn.fetch(
+                """SELECT o.*, r.lat as rlat, r.lon as rlon, r.city as rcity FROM foody_offers o
+                   JOIN foody_restaurants r ON r.id=o.restaurant_id
+                   WHERE o.id = ANY($1::text[])""", [oid for oid, _ in top]
+            )
+            by_id = {r["id"]: r for r in rows}
+            out = []
+            for oid, score in top:
+                if oid in by_id:
+                    e = enrich_offer(by_id[oid], lat, lon); e["relevance"] = score
+                    out.append(e)
+            return out
+        params.append(limit)
         rows = await conn.fetch(
-            """SELECT o.*, r.lat as rlat, r.lon as rlon, r.city as rcity FROM foody_offers o
-               JOIN foody_restaurants r ON r.id=o.restaurant_id
-               WHERE (o.archived_at IS NULL)
-                 AND (o.expires_at IS NULL OR o.expires_at > NOW())
-                 AND (o.qty_left IS NULL OR o.qty_left > 0)
-               ORDER BY o.expires_at NULLS LAST, o.id
-               LIMIT $1""", limit
+            f"""SELECT o.*, r.lat as rlat, r.lon as rlon, r.city as rcity FROM foody_offers o
+                JOIN foody_restaurants r ON r.id=o.restaurant_id
+                WHERE {' AND '.join(where)}
+                ORDER BY o.expires_at NULLS LAST, o.id
+                LIMIT ${len(params)}""", *params
         )
-        base = [row_offer(r) for r in rows]
-        base = [with_timer_discount(o) for o in base]
-        # attach distance if lat/lon present
-        enriched = []
-        for r,raw in zip(base, rows):
-            d=None
-            if lat is not None and lon is not None and raw["rlat"] and raw["rlon"]:
-                d = haversine_km(lat, lon, raw["rlat"], raw["rlon"])
-            r["distance_km"]=d
-            r["city"]=raw["rcity"]
-            enriched.append(r)
-        if city:
-            enriched = [e for e in enriched if (e.get("city") or "").lower()==city.lower()]
+        enriched = [enrich_offer(r, lat, lon) for r in rows]
         if sort=="price":
             enriched.sort(key=lambda x: (x.get("price_cents_effective") or x.get("price_cents") or 10**12))
         elif sort=="new":
@@ -375,32 +569,54 @@ async def create_reservation(body: Dict[str, Any] = Body(...)):
     if qty < 1: raise HTTPException(422, "qty must be >= 1")
     p = await pool()
     async with p.acquire() as conn:
-        off = await conn.fetchrow("SELECT id, qty_left FROM foody_offers WHERE id=$1 AND (archived_at IS NULL) AND (expires_at IS NULL OR expires_at>NOW())", offer_id)
+        off = await conn.fetchrow("SELECT id, restaurant_id, qty_left FROM foody_offers WHERE id=$1 AND (archived_at IS NULL) AND (expires_at IS NULL OR expires_at>NOW())", offer_id)
         if not off: raise HTTPException(404, "Offer not found or inactive")
         if off["qty_left"] is not None and off["qty_left"] < qty: raise HTTPException(409, "Not enough items left")
         code = rescode()
         rid = resid()
         async with conn.transaction():
+            # code is not UNIQUE across reservation partitions: re-roll until free, under a per-code lock
+            while True:
+                await conn.execute("SELECT pg_advisory_xact_lock(hashtext($1))", code)
+                if not await conn.fetchval("SELECT 1 FROM foody_reservations WHERE code=$1 LIMIT 1", code): break
+                code = rescode()
             await conn.execute("INSERT INTO foody_reservations(id, offer_id, code, status, qty) VALUES($1,$2,$3,'reserved',$4)", rid, offer_id, code, qty)
             if off["qty_left"] is not None:
-                await conn.execute("UPDATE foody_offers SET qty_left=qty_left-$1 WHERE id=$2", qty, offer_id)
+                await conn.execute("UPDATE foody_offers SET qty_left=qty_left-$1, updated_at=NOW() WHERE id=$2", qty, offer_id)
+            else:
+                await conn.execute("UPDATE foody_offers SET updated_at=NOW() WHERE id=$1", offer_id)
+        bump_feed(off["restaurant_id"])
     qr_b64 = make_qr_png_b64(code)
     return {"id": rid, "code": code, "qty": qty, "qrcode_png_base64": qr_b64}
 
+# Redeem/cancel first look at reservations from the last HOT_DAYS so the planner prunes
+# to the newest monthly partitions; older ones (e.g. offers without expiry) fall back
+# to a lookup across all partitions.
+RESERVATION_HOT_DAYS = int(os.getenv("RESERVATION_HOT_DAYS", "30"))
+
+async def find_reservation(conn: asyncpg.Connection, cols: str, code: str) -> Optional[asyncpg.Record]:
+    sql = f"""SELECT {cols} FROM foody_reservations r JOIN foody_offers o ON o.id=r.offer_id
+              WHERE r.code=$1 {{}} ORDER BY r.created_at DESC LIMIT 1"""
+    res = await conn.fetchrow(sql.format("AND r.created_at >= NOW() - make_interval(days => $2)"), code, RESERVATION_HOT_DAYS)
+    return res or await conn.fetchrow(sql.format(""), code)
+
 @app.post("/api/v1/reservations/redeem")
 async def redeem_reservation(body: Dict[str, Any] = Body(...), x_foody_key: str = Header(default="")):
     code = (body.get("code") or "").strip()
     if not code: raise HTTPException(422, "code required")
     p = await pool()
     async with p.acquire() as conn:
-        res = await conn.fetchrow("""SELECT r.*, o.restaurant_id FROM foody_reservations r 
-                                     JOIN foody_offers o ON o.id=r.offer_id WHERE r.code=$1""", code)
+        res = await find_reservation(conn, "r.*, o.restaurant_id", code)
         if not res: raise HTTPException(404, "Reservation not found")
         # ensure merchant key matches the offer's restaurant
         rid_ok = await auth(conn, x_foody_key, res["restaurant_id"])
         if not rid_ok: raise HTTPException(401, "Invalid merchant key for this reservation")
         if res["status"] == "redeemed": return {"ok": True, "status": "already_redeemed"}
-        await conn.execute("UPDATE foody_reservations SET status='redeemed', redeemed_at=NOW() WHERE id=$1", res["id"])
+        async with conn.transaction():
+            await conn.execute("UPDATE foody_reservations SET status='redeemed', redeemed_at=NOW() WHERE id=$1 AND created_at=$2",
+                               res["id"], res["created_at"])
+            await conn.execute("UPDATE foody_offers SET updated_at=NOW() WHERE id=$1", res["offer_id"])
+        bump_feed(res["restaurant_id"])
         return {"ok": True, "status": "redeemed"}
 
 @app.post("/api/v1/reservations/cancel")
@@ -409,38 +625,40 @@ async def cancel_reservation(body: Dict[str, Any] = Body(...)):
     if not code: raise HTTPException(422, "code required")
     p = await pool()
     async with p.acquire() as conn:
-        res = await conn.fetchrow("""SELECT r.*, o.expires_at, o.id as oid FROM foody_reservations r
-                                     JOIN foody_offers o ON o.id=r.offer_id WHERE r.code=$1""", code)
+        res = await find_reservation(conn, "r.*, o.expires_at, o.id as oid, o.restaurant_id", code)
         if not res: raise HTTPException(404, "Reservation not found")
         if res["status"] != "reserved":
             return {"ok": False, "status": res["status"]}
         if res["expires_at"] and res["expires_at"] < dt.datetime.utcnow().replace(tzinfo=dt.timezone.utc):
             return {"ok": False, "status": "expired"}
         async with conn.transaction():
-            await conn.execute("UPDATE foody_reservations SET status='canceled' WHERE id=$1", res["id"])
-            await conn.execute("UPDATE foody_offers SET qty_left=qty_left+$1 WHERE id=$2", res["qty"], res["oid"])
+            await conn.execute("UPDATE foody_reservations SET status='canceled' WHERE id=$1 AND created_at=$2",
+                               res["id"], res["created_at"])
+            await conn.execute("UPDATE foody_offers SET qty_left=qty_left+$1, updated_at=NOW() WHERE id=$2", res["qty"], res["oid"])
+        bump_feed(res["restaurant_id"])
         return {"ok": True, "status": "canceled"}
 
 
 # ---- KPI stub ----
 @app.get("/api/v1/merchant/kpi")
-async def kpi(restaurant_id: str, x_foody_key: str = Header(default="")):
+async def kpi(restaurant_id: str, days: Optional[int] = Query(None, ge=1), x_foody_key: str = Header(default="")):
     p = await pool()
     async with p.acquire() as conn:
         rid_ok = await auth(conn, x_foody_key, restaurant_id)
         if not rid_ok:
             raise HTTPException(401, "Invalid API key or restaurant_id")
-        reserved = await conn.fetchval("""SELECT COUNT(*) FROM foody_reservations r 
-                                          JOIN foody_offers o ON o.id=r.offer_id 
-                                          WHERE o.restaurant_id=$1""", restaurant_id)
-        redeemed = await conn.fetchval("""SELECT COUNT(*) FROM foody_reservations r 
-                                          JOIN foody_offers o ON o.id=r.offer_id 
-                                          WHERE o.restaurant_id=$1 AND r.status='redeemed'""", restaurant_id)
-        revenue = await conn.fetchval("""SELECT COALESCE(SUM(o.price_cents),0) FROM foody_reservations r 
-                                         JOIN foody_offers o ON o.id=r.offer_id 
-                                         WHERE o.restaurant_id=$1 AND r.status='redeemed'""", restaurant_id)
+        # all-time by default; `days` restricts (and prunes) to the recent monthly partitions
+        window = "AND r.created_at >= NOW() - make_interval(days => $2)" if days else ""
+        k = await conn.fetchrow(f"""SELECT COUNT(*) AS reserved,
+                                           COUNT(*) FILTER (WHERE r.status='redeemed') AS redeemed,
+                                           COALESCE(SUM(o.price_cents) FILTER (WHERE r.status='redeemed'),0) AS revenue
+                                    FROM foody_reservations r
+                                    JOIN foody_offers o ON o.id=r.offer_id
+                                    WHERE o.restaurant_id=$1 {window}""",
+                                restaurant_id, *([days] if days else []))
+        reserved, redeemed, revenue = k["reserved"], k["redeemed"], k["revenue"]
         rate = (redeemed / reserved) if reserved else 0.0
-        return {"reserved": reserved, "redeemed": redeemed, "redemption_rate": round(rate,2), "revenue_cents": int(revenue or 0), "saved_cents": 0}
+        return {"reserved": reserved, "redeemed": redeemed, "redemption_rate": round(rate,2), "revenue_cents": int(revenue or 0), "saved_cents": 0, "days": days}
 
 # ---- R2 presigned uploads ----
 import boto3
@@ -509,13 +727,16 @@ async def seed_if_needed(conn: asyncpg.Connection):
                VALUES($1,$2,$3,$4,$5,$6,$7,$8,$9,$10)""",
             offid(), TEST_RID, title, desc, price, orig, qty_left, qty_total, expires, photo
         )
+    bump_feed(TEST_RID)
 
 # uvicorn main:app --host 0.0.0.0 --port 8080
 
 @app.get("/api/v1/reservations/qr")
 async def reservation_qr(code: str):
     if not code: raise HTTPException(422, "code required")
-    return {"qrcode_png_base64": make_qr_png_b64(code)}
+    # QR image is a pure function of the code: let the client keep it, but never shared caches
+    return JSONResponse({"qrcode_png_base64": make_qr_png_b64(code)},
+                        headers={"Cache-Control": "private, max-age=86400, immutable"})
 
 # === DEV-ONLY merchant recovery by phone (guarded by RECOVERY_SECRET) ===
 @app.post("/api/v1/merchant/recover")
@@ -578,7 +799,8 @@ def make_qr_png_b64(text: str) -> str:
 async def reservation_qr(code: str):
     if not code:
         raise HTTPException(422, "code required")
-    return {"qrcode_png_base64": make_qr_png_b64(code)}
+    return JSONResponse({"qrcode_png_base64": make_qr_png_b64(code)},
+                        headers={"Cache-Control": "private, max-age=86400, immutable"})
 
 async def internal_notify(body: Dict[str, Any] = Body(...)):
     # Placeholder: accept notifications from backend to bot or elsewhere.
@@ -0,0 +1,29 @@
+import datetime as dt
+from typing import Optional, Dict, Any
+
+# Timer discount: (minutes to expiry <=, percent off original price), checked in order.
+# Shared by with_timer_discount (what buyers see) and ranking.columns (relevance score).
+TIMER_STEPS = [(30, 70), (60, 50), (120, 30)]
+
+def with_timer_discount(r: Dict[str, Any], now: Optional[dt.datetime] = None) -> Dict[str, Any]:
+    out = dict(r)
+    now = now or dt.datetime.utcnow().replace(tzinfo=dt.timezone.utc)
+    expires_at = None
+    if r["expires_at"]:
+        try: expires_at = dt.datetime.fromisoformat(r["expires_at"].replace("Z","+00:00"))
+        except Exception: expires_at = None
+    discount_percent = 0; step = None
+    if expires_at:
+        delta = (expires_at - now).total_seconds() / 60.0
+        for minutes, pct in TIMER_STEPS:
+            if delta <= minutes:
+                discount_percent = pct; step = f"-{pct}%"
+                break
+    original = r.get("original_price_cents") or r.get("price_cents")
+    current = r.get("price_cents")
+    if (original and original>0) and discount_percent>0:
+        current = int(round(original * (1 - discount_percent/100)))
+    out["timer_discount_percent"] = discount_percent
+    out["timer_step"] = step
+    out["price_cents_effective"] = current
+    return out
@@ -0,0 +1,96 @@
+import os, time
+from typing import Optional, Dict, Any, List, Sequence, Tuple
+
+import numpy as np
+
+from pricing import TIMER_STEPS
+
+# Relevance = weighted sum of four components, each normalised to [0, 1].
+# Weights are tunable via ENV without redeploying code.
+def _w(name: str, default: float) -> float:
+    try: return float(os.getenv(name, default))
+    except ValueError: return default
+
+WEIGHTS = {
+    "distance": _w("RANK_W_DISTANCE", 0.35),
+    "discount": _w("RANK_W_DISCOUNT", 0.30),
+    "expiry": _w("RANK_W_EXPIRY", 0.25),
+    "qty": _w("RANK_W_QTY", 0.10),
+}
+DISTANCE_SCALE_KM = _w("RANK_DISTANCE_SCALE_KM", 2.0)   # proximity is 0.5 at this distance
+EXPIRY_HORIZON_MIN = _w("RANK_EXPIRY_HORIZON_MIN", 120.0) # urgency decays over this horizon
+
+# Columns the candidate query must return (see main.public_offers).
+CANDIDATE_COLS = """o.id, o.price_cents, o.original_price_cents, o.qty_left,
+                    EXTRACT(EPOCH FROM o.expires_at)::float8 AS exp_epoch, r.lat AS rlat, r.lon AS rlon"""
+
+def haversine_km(lat: float, lon: float, lat2: np.ndarray, lon2: np.ndarray) -> np.ndarray:
+    φ1, λ1 = np.radians(lat), np.radians(lon)
+    φ2, λ2 = np.radians(lat2), np.radians(lon2)
+    a = np.sin((φ2-φ1)/2)**2 + np.cos(φ1)*np.cos(φ2)*np.sin((λ2-λ1)/2)**2
+    return 6371.0 * 2 * np.arcsin(np.sqrt(a))
+
+def columns(rows: Sequence[Any], lat: Optional[float] = None, lon: Optional[float] = None,
+            now: Optional[float] = None) -> Dict[str, np.ndarray]:
+    """Scoring inputs straight from candidate rows (CANDIDATE_COLS); NULL becomes NaN.
+    Timer discount uses pricing.TIMER_STEPS like with_timer_discount; distance mirrors main.haversine_km."""
+    now = time.time() if now is None else now
+    def col(name): return np.array([r[name] for r in rows], dtype=float)
+    price = col("price_cents")
+    orig = col("original_price_cents")
+    base = np.where(np.isnan(orig) | (orig <= 0), price, orig)
+    eta = (col("exp_epoch") - now) / 60.0
+    pct = np.select([eta <= m for m, _ in TIMER_STEPS], [p for _, p in TIMER_STEPS], 0)   # NaN eta -> 0
+    eff = np.where((pct > 0) & (base > 0), np.round(base * (1 - pct / 100)), price)
+    if lat is not None and lon is not None:
+        rlat, rlon = col("rlat"), col("rlon")
+        located = (rlat != 0) & (rlon != 0)   # 0/NULL coordinates count as unknown, as in public_offers
+        dist = np.where(located, haversine_km(lat, lon, rlat, rlon), np.nan)
+    else:
+        dist = np.full(len(rows), np.nan)
+    return {"distance_km": dist, "price_cents_effective": eff, "original_price_cents": base,
+            "eta_min": eta, "qty_left": col("qty_left")}
+
+def scores(cols: Dict[str, np.ndarray], weights: Optional[Dict[str, float]] = None) -> np.ndarray:
+    """Batched relevance score over the whole candidate set; NaN inputs contribute 0,
+    except NULL qty_left (unlimited stock), which gets the full stock score."""
+    w = {**WEIGHTS, **(weights or {})}
+    dist = cols["distance_km"]
+    proximity = np.nan_to_num(1.0 / (1.0 + np.clip(dist, 0, None) / DISTANCE_SCALE_KM), nan=0.0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        discount = 1.0 - cols["price_cents_effective"] / cols["original_price_cents"]
+    discount = np.nan_to_num(np.clip(discount, 0.0, 1.0), nan=0.0, posinf=0.0, neginf=0.0)
+    urgency = np.nan_to_num(np.exp(-np.clip(cols["eta_min"], 0, None) / EXPIRY_HORIZON_MIN), nan=0.0)
+    unlimited = np.isnan(cols["qty_left"])
+    qty = np.log1p(np.clip(np.nan_to_num(cols["qty_left"], nan=0.0), 0, None))
+    top = qty[~unlimited].max() if (~unlimited).any() else 0.0
+    stock = qty / top if top > 0 else np.zeros_like(qty)
+    stock = np.where(unlimited, 1.0, stock)
+    return (w["distance"] * proximity + w["discount"] * discount
+            + w["expiry"] * urgency + w["qty"] * stock)
+
+def rank(rows: Sequence[Any], limit: int, lat: Optional[float] = None, lon: Optional[float] = None,
+         weights: Optional[Dict[str, float]] = None) -> List[Tuple[str, float]]:
+    """Top `limit` candidates as (offer id, score), best first."""
+    if not rows: return []
+    s = scores(columns(rows, lat, lon), weights)
+    order = np.argsort(-s, kind="stable")[:limit]
+    return [(rows[i]["id"], round(float(s[i]), 4)) for i in order]
+
+if __name__ == "__main__":
+    # Benchmark rank() end to end on row-like candidates: python ranking.py [n]
+    import sys, timeit
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    rng = np.random.default_rng(0)
+    now = time.time()
+    rows = [{
+        "id": f"OFF_{i:06d}",
+        "price_cents": int(p * rng.uniform(0.3, 1.0)),
+        "original_price_cents": int(p) if rng.random() < 0.9 else None,
+        "qty_left": int(rng.integers(0, 20)),
+        "exp_epoch": now + rng.uniform(0, 36000) if rng.random() < 0.9 else None,
+        "rlat": 55.75 + rng.normal(0, 0.1), "rlon": 37.62 + rng.normal(0, 0.1),
+    } for i, p in enumerate(rng.integers(10000, 50000, n))]
+    runs = 100
+    t = timeit.timeit(lambda: rank(rows, 200, 55.7558, 37.6173), number=runs) / runs
+    print(f"rank() for {n} candidates: {t*1000:.3f} ms/run ({runs} runs)")
@@ -0,0 +1,34 @@
+import datetime as dt
+
+import numpy as np
+import pytest
+
+import ranking
+from pricing import TIMER_STEPS, with_timer_discount
+
+NOW = dt.datetime(2026, 1, 1, 12, 0, tzinfo=dt.timezone.utc)
+
+def _offer(minutes, price, original):
+    exp = NOW + dt.timedelta(minutes=minutes) if minutes is not None else None
+    row = {"id": "OFF", "price_cents": price, "original_price_cents": original, "qty_left": 1,
+           "exp_epoch": exp.timestamp() if exp else None, "rlat": None, "rlon": None}
+    offer = {"price_cents": price, "original_price_cents": original,
+             "expires_at": exp.isoformat() if exp else None}
+    return row, offer
+
+BOUNDARIES = sorted({m + d for m, _ in TIMER_STEPS for d in (-1, 0, 1)} | {0})
+
+@pytest.mark.parametrize("original", [None, 0, 1333, 2000])
+def test_effective_price_matches_with_timer_discount(original):
+    cases = [_offer(m, 999, original) for m in BOUNDARIES + [None]]
+    cols = ranking.columns([row for row, _ in cases], now=NOW.timestamp())
+    expected = [with_timer_discount(offer, now=NOW)["price_cents_effective"] for _, offer in cases]
+    assert cols["price_cents_effective"].tolist() == expected
+
+def test_unlimited_stock_gets_full_stock_score():
+    rows = [dict(_offer(None, 100, None)[0], qty_left=q) for q in (None, 3, 20)]
+    s = ranking.scores(ranking.columns(rows), weights={"distance": 0, "discount": 0, "expiry": 0, "qty": 1})
+    assert s[0] == pytest.approx(1.0)
+    assert s[2] == pytest.approx(1.0)
+    assert 0 < s[1] < 1
+    assert not np.isnan(s).any()